@@ -76,6 +76,30 @@ class Vary(enum.StrEnum):
     LIST = "list"
 
 
+class NoiseMethod(enum.StrEnum):
+    """
+    This represents the method of `ValuePerlin.method` that generates the spatially varying field.
+    """
+
+    PERLIN = "perlin"
+    """
+    Perlin noise, sampled cell by cell.
+    This is the default.
+    """
+
+    VALUE = "value_noise"
+    """
+    Random values drawn on a coarse lattice that are linearly interpolated to the cells of the domain.
+    Much faster than `PERLIN` for large domains, but the fields look more blocky.
+    """
+
+    SMOOTHED = "gaussian_smoothed"
+    """
+    Random values drawn for each cell that are smoothed with a gaussian filter along each axis.
+    Also much faster than `PERLIN` for large domains.
+    """
+
+
 class SimTool(enum.StrEnum):
     """
     Enum behind `GeneralConfig.sim_tool`.
@@ -199,6 +223,12 @@ class ValuePerlin(BaseModel):
     max: float
     min: float
 
+    method: NoiseMethod = NoiseMethod.PERLIN
+    """
+    The method used to generate the field.
+    The `frequency` has the same meaning for all methods, i.e., roughly how many features there are in each direction.
+    """
+
     model_config = ConfigDict(extra="forbid")
 
     @model_validator(mode="after")
@@ -222,7 +252,7 @@ class ValuePerlin(BaseModel):
         return self
 
     def __str__(self) -> str:
-        return f"Freq: {self.frequency}, [{self.min} <= {self.max}]"
+        return f"{self.method}, Freq: {self.frequency}, [{self.min} <= {self.max}]"
 
 
 class HeatPump(BaseModel):
@@ -512,6 +542,15 @@ class GeneralConfig(BaseModel):
     Therefore, the value of `1` is the default.
     """
 
+    variation_workers: None | PositiveInt = 1
+    """
+    The number of processes used to generate the `DataPoint`s during the variation stage.
+    Setting this to `None` uses as many processes as there are cores available.
+    With the default of `1`, all `DataPoint`s are generated sequentially in the main process.
+    Each `DataPoint` is varied with its own random number generator, seeded from `random_seed`, so the results don't
+    depend on the number of processes.
+    """
+
     mute_simulation_output: bool = False
     """
     Some simulation tools produce output that can be muted.
@@ -524,6 +563,13 @@ class GeneralConfig(BaseModel):
     Useful for generating data sets with many data points.
     """
 
+    visualization_workers: None | PositiveInt = 1
+    """
+    The number of processes used to plot the `DataPoint`s during the visualization stage.
+    Setting this to `None` uses as many processes as there are cores available.
+    With the default of `1`, all `DataPoint`s are plotted sequentially in the main process.
+    """
+
     # This makes pydantic fail if there is extra data in the YAML settings file that cannot be parsed
     model_config = ConfigDict(extra="forbid")
 
@@ -545,6 +591,8 @@ class GeneralConfig(BaseModel):
             f"    Cell resolution: {self.cell_resolution}\n"
             f"    Time to simulate: {str(self.time_to_simulate)}\n"
             f"    Profiling: {self.profiling}\n"
+            f"    Variation workers: {self.variation_workers}\n"
+            f"    Visualization workers: {self.visualization_workers}\n"
         )
 
 
@@ -620,6 +668,8 @@ class State(BaseModel):
     """
     The random number generator that should be used whenever randomness is needed throughout the execution of the
     program.
+    The only exception is the generation of the `DataPoint`s, where each `DataPoint` uses its own generator so they can
+    be generated independently, see `vampireman.variation_stage.vary.generate_datapoint`.
     It is initialized with `GeneralConfig.random_seed`.
     When initialized with `None`, it will be nondeterministic.
     """
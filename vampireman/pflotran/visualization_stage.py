@@ -7,30 +7,64 @@ It reads in pflotran.h5 files and generates three images:
 - all the properties that PFLOTRAN stores into the pflotran.h5 file
 """
 
+import functools
 import logging
+import re
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from typing import Any, cast
 
 import h5py
+import matplotlib
+import matplotlib.colors as colors
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.cm import ScalarMappable
+from matplotlib.figure import Figure, SubplotParams
+from matplotlib.image import AxesImage
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
-from ..data_structures import Data, State
+from ..data_structures import Data, DataPoint, State
+from ..utils import prepare_worker_pool
 
 TimeData = OrderedDict[str, dict[str, Any]]
 """
 This data structure is used to store plottable data in a typed manner.
 """
 
+FIGURES: dict[tuple[str, int, int], Figure] = {}
+"""
+The figures that are reused across the plotted `vampireman.data_structures.DataPoint`s, see `get_figure()`.
+They are freed with `release_figures()` at the end of the `visualization_stage()`, worker processes free them on exit.
+"""
+
+PROPERTY_PLOTS: dict[tuple[int, tuple[str, ...], tuple[int, ...]], tuple[Figure, list[list[AxesImage]]]] = {}
+"""
+The figures of `plot_y()` together with their images, which get new data for each further
+`vampireman.data_structures.DataPoint` that is plotted.
+Just like `FIGURES`, they are freed with `release_figures()`.
+"""
 
+TIME_STEP_PATTERN = re.compile(r"Time\s+(\S+)\s+y")
+"""
+Matches the time in years of PFLOTRAN hdf5 time step names, see `pflotran_time_to_year()`.
+"""
+
+
+@functools.lru_cache(maxsize=1024)
 def pflotran_time_to_year(time_step: str) -> float:
     """
     Get year from PFLOTRAN hdf5 files such as '   3 Time  5.00000E+00 y' -> 5.0
+    The results are cached, as the same time steps appear in the files of all `vampireman.data_structures.DataPoint`s.
     """
-    return float(time_step.split(" ")[-2])
+    match = TIME_STEP_PATTERN.search(time_step)
+    if match is None:
+        raise ValueError(f"Cannot read the time from time step {time_step!r}")
+    return float(match.group(1))
 
 
 def visualization_stage(state: State):
@@ -44,40 +78,95 @@ def visualization_stage(state: State):
     if len(state.datapoints) == 0:
         logging.error("There are no datapoints that could be plotted. Did you skip the previous stages?")
 
-    # XXX: Could probably run in separate threads, but need to handle case of num_datapoints > num_processors
-    for datapoint in state.datapoints:
-        datapoint_path = state.general.output_directory / f"datapoint-{datapoint.index}"
+    # Only the middle z level of the domain gets plotted
+    level = int((cast(np.ndarray, state.general.number_cells)[2] - 1) / 2)
 
-        with h5py.File(datapoint_path / "pflotran.h5") as file:
-            list_to_plot = make_plottable(state, file)
+    workers = state.general.visualization_workers
 
-        plot_y(list_to_plot, datapoint_path)
-        plot_isolines(state, list_to_plot, datapoint_path)
-        # TODO: make this more general
-        plot_vary_field(state, datapoint_path, datapoint.data["permeability"])
+    if workers == 1 or len(state.datapoints) <= 1:
+        try:
+            for datapoint in state.datapoints:
+                plot_datapoint(state, datapoint, level)
+        finally:
+            # The figures are only reused during this stage, afterwards they would just hold on to memory
+            release_figures()
+    else:
+        number_workers, chunksize, worker_state = prepare_worker_pool(state, workers, len(state.datapoints))
 
+        # The workers only write image files, so they don't need an interactive backend
+        with ProcessPoolExecutor(max_workers=number_workers, initializer=matplotlib.use, initargs=("Agg",)) as executor:
+            # Consuming the results raises the errors of the workers here
+            for _ in executor.map(
+                plot_datapoint, repeat(worker_state), state.datapoints, repeat(level), chunksize=chunksize
+            ):
+                pass
+        logging.debug("Plotted %s datapoints with %s worker processes", len(state.datapoints), number_workers)
 
-def make_plottable(state: State, hdf5_file: h5py.File) -> TimeData:
+
+def plot_datapoint(state: State, datapoint: DataPoint, level: int):
+    """
+    Reads the pflotran.h5 file of a single `vampireman.data_structures.DataPoint` and plots it.
+    `vampireman.data_structures.DataPoint`s don't depend on each other, so this can be called for each of them
+    independently and in any order.
+    """
+
+    datapoint_path = state.general.output_directory / f"datapoint-{datapoint.index}"
+
+    with h5py.File(datapoint_path / "pflotran.h5") as file:
+        list_to_plot = make_plottable(state, file, level)
+
+    plot_y(list_to_plot, datapoint_path)
+    plot_isolines(state, list_to_plot, datapoint_path)
+    # TODO: make this more general
+    plot_vary_field(state, datapoint_path, datapoint.data["permeability"])
+
+
+def make_plottable(state: State, hdf5_file: h5py.File, level: None | int = None) -> TimeData:
     """
     This function can be called to read a PFLOTRAN hdf5 file and store the data in an organized manner into a `TimeData`
     data structure.
+    If a z `level` is given, only this slice of the domain is read from the file and the data is 2D instead of 3D.
+    The time steps are ordered by their time.
     """
 
-    dimensions = cast(np.ndarray, state.general.number_cells)
+    # The cells might be given as a list, too
+    dimensions = np.asarray(state.general.number_cells)
+
+    if level is None:
+        # Read the whole dataset and reshape the data to match the 3D space of the domain
+        shape = tuple(dimensions.tolist())
+        selection = np.s_[:]
+    else:
+        # PFLOTRAN stores the cells in Fortran order, so each z level is a contiguous block of the flat dataset. Read
+        # only the cells of the z level and reshape them to match the 2D slice of the domain
+        shape = tuple(dimensions[:2].tolist())
+        plane_size = int(dimensions[0] * dimensions[1])
+        selection = np.s_[level * plane_size : (level + 1) * plane_size]
+    size = int(np.prod(shape))
+    number_of_cells = int(dimensions[0] * dimensions[1] * dimensions[2])
 
     datapoints_to_plot: TimeData = OrderedDict()
 
-    for time_step, timegroup in hdf5_file.items():
+    # h5py lists the groups by name, sorting by the time makes sure the time steps are in temporal order
+    time_steps = sorted(hdf5_file.keys(), key=pflotran_time_to_year)
+
+    for time_step in time_steps:
+        timegroup = cast(h5py.Group, hdf5_file[time_step])
         datapoints_to_plot[time_step] = OrderedDict()
 
         for property, property_values in timegroup.items():
-            # Read from the hdf5 file
-            data = np.array(property_values)
-
-            # Reshape the data to match the 3D space of the domain
-            data = data.reshape(dimensions, order="F")
-
-            datapoints_to_plot[time_step][property] = data
+            # The selection alone would silently read the wrong cells if the file doesn't match the domain
+            if property_values.shape[0] != number_of_cells:
+                raise ValueError(
+                    f"{property} of time step {time_step.strip()!r} has {property_values.shape[0]} cells, but the "
+                    f"domain with number_cells {dimensions.tolist()} has {number_of_cells} cells"
+                )
+
+            # Read straight into the array that is kept, so h5py doesn't allocate another one
+            data = np.empty(size, dtype=property_values.dtype)
+            property_values.read_direct(data, source_sel=selection)
+
+            datapoints_to_plot[time_step][property] = data.reshape(shape, order="F")
     return datapoints_to_plot
 
 
@@ -86,96 +175,150 @@ def plot_y(data: TimeData, path: Path):
     Iterates over all PFLOTRAN properties and plots them into a large image.
     Each line is the output of a certain PFLOTRAN output time step, whereas each column represents a different PFLOTRAN
     property.
+    The `data` is expected to be 2D, see `make_plottable()`.
+    The figure is built once per process, further `vampireman.data_structures.DataPoint`s with the same properties only
+    update the data of its images.
     """
 
     rows = len(data)
-    key, val = data.popitem()
-    cols = len(val)
-    data[key] = val
-
-    _, axes = plt.subplots(rows, cols, figsize=(20 * cols, 5 * rows))
-
-    for row, (_, time_data) in enumerate(data.items()):
-        for col, (property_name, property_data) in enumerate(time_data.items()):
-            plt.sca(axes[row][col])
-
-            # Make the 3D data 2D so it can be plotted
-            level = int((property_data.shape[2] - 1) / 2)
-            plot_data = property_data[:, :, level]
-            plt.imshow(plot_data)
-
-            plt.xlabel("cells y")
-            plt.ylabel("cells x or z")
-            aligned_colorbar(label=property_name)
+    # Each time step has the same properties, so the first one tells the number of columns without modifying `data`
+    first_time_data = next(iter(data.values()))
+    cols = len(first_time_data)
+
+    # The images can only be reused for the same properties in the same shape
+    plot_key = (rows, tuple(first_time_data.keys()), next(iter(first_time_data.values())).shape)
+    plot = PROPERTY_PLOTS.get(plot_key)
+
+    if plot is None:
+        fig = Figure(figsize=(20 * cols, 5 * rows))
+        axes = fig.subplots(rows, cols, squeeze=False)
+        images: list[list[AxesImage]] = []
+
+        for row, (_, time_data) in enumerate(data.items()):
+            images.append([])
+            for col, (property_name, property_data) in enumerate(time_data.items()):
+                ax = axes[row][col]
+                image = ax.imshow(property_data, interpolation="nearest")
+                images[row].append(image)
+
+                ax.set_xlabel("cells y")
+                ax.set_ylabel("cells x or z")
+                aligned_colorbar(fig, ax, image, label=property_name)
+
+        PROPERTY_PLOTS[plot_key] = (fig, images)
+    else:
+        # Only swap the data of the existing images, the colorbars follow the new limits of their image
+        fig, images = plot
+        for row, (_, time_data) in enumerate(data.items()):
+            for col, property_data in enumerate(time_data.values()):
+                images[row][col].set_data(property_data)
+                images[row][col].set_clim(property_data.min(), property_data.max())
+
+    # The width of the tick labels depends on the data, so the layout is computed for each datapoint. It starts from the
+    # default subplot parameters, as running tight_layout on its own result shrinks the axes of make_axes_locatable
+    default = SubplotParams()
+    fig.subplots_adjust(default.left, default.bottom, default.right, default.top, default.wspace, default.hspace)
+    fig.tight_layout()
 
     pic_file_name = path / "Pflotran_properties_2d.jpg"
     logging.info(f"Resulting picture is at {pic_file_name}")
-    plt.tight_layout()
-    plt.savefig(pic_file_name)
+    fig.savefig(pic_file_name)
 
 
 def plot_isolines(state: State, data: TimeData, path: Path):
     """
     Plots the temperature fields as isolines.
+    The `data` is expected to be 2D, see `make_plottable()`.
     """
 
     rows = len(data)
-    _, axes = plt.subplots(rows, 1, figsize=(20, 5 * rows))
+    fig, axes = get_figure("isolines", rows, 1, figsize=(20, 5 * rows))
 
     level_min = float("inf")
     level_max = -float("inf")
-    level_step = None
 
+    # Only the plotted slices are taken into account, as `make_plottable()` did not read the rest of the domain
     for _, time_data in data.items():
         level_min = min(level_min, time_data["Temperature [C]"].min())
         level_max = max(level_max, time_data["Temperature [C]"].max())
     if level_min > level_max:
         raise ValueError("level_min is larger than level_max")
-    # XXX: Why 24 here?
-    level_step = (level_max - level_min) / 24
 
-    levels = np.arange(level_min, level_max, level_step)
+    # XXX: Why 24 here?
+    # Unlike np.arange with a float step, np.linspace always includes level_max, so the hottest cells are filled, too
+    levels = np.linspace(level_min, level_max, 24 + 1)
+    norm = colors.Normalize(vmin=level_min, vmax=level_max)
 
     for index, (time_step, time_data) in enumerate(data.items()):
         property_data = time_data.get("Temperature [C]")
         assert property_data is not None
 
-        plt.sca(axes[index])
-
-        x_ticks = ticker.FuncFormatter(lambda x, pos: f"{x*state.general.cell_resolution:g}")
-        y_ticks = ticker.FuncFormatter(lambda y, pos: f"{y*state.general.cell_resolution:g}")
-        axes[index].xaxis.set_major_formatter(x_ticks)
-        axes[index].yaxis.set_major_formatter(y_ticks)
-
-        # Make the 3D data 2D so it can be plotted
-        level = int((property_data.shape[2] - 1) / 2)
-        plot_data = property_data[:, :, level]
+        ax = axes[index][0]
+        # A formatter belongs to a single axis, so each axis gets its own
+        ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda x, pos: f"{x*state.general.cell_resolution:g}"))
+        ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda y, pos: f"{y*state.general.cell_resolution:g}"))
 
-        plt.contourf(plot_data, levels=levels, cmap="RdBu_r")
+        contour = ax.contourf(property_data, levels=levels, cmap="RdBu_r", norm=norm)
 
-        plt.title(f"{pflotran_time_to_year(time_step)} years")
-        plt.xlabel("y [m]")
-        plt.ylabel("x [m]")
-        aligned_colorbar(label="Temperature [°C]")
+        ax.set_title(f"{pflotran_time_to_year(time_step)} years")
+        ax.set_xlabel("y [m]")
+        ax.set_ylabel("x [m]")
+        aligned_colorbar(fig, ax, contour, label="Temperature [°C]")
 
     pic_file_name = path / "Pflotran_isolines.jpg"
     logging.info(f"Resulting picture is at {pic_file_name}")
-    plt.suptitle("Isolines of Temperature [°C]")
-    plt.savefig(pic_file_name)
+    fig.suptitle("Isolines of Temperature [°C]")
+    fig.savefig(pic_file_name)
+
+
+def release_figures():
+    """
+    Frees the figures that are reused across the plotted `vampireman.data_structures.DataPoint`s, see `get_figure()` and
+    `plot_y()`.
+    """
+
+    for fig in FIGURES.values():
+        fig.clear()
+    for fig, _ in PROPERTY_PLOTS.values():
+        fig.clear()
+
+    FIGURES.clear()
+    PROPERTY_PLOTS.clear()
+
+
+def get_figure(name: str, rows: int, cols: int, figsize: tuple[float, float]) -> tuple[Figure, np.ndarray]:
+    """
+    Get an empty figure with a `rows` x `cols` grid of axes for the plot called `name`.
+    The figure is created once per process and cleared for each further `vampireman.data_structures.DataPoint` that is
+    plotted, instead of creating a new figure each time.
+    As the figure is not managed by pyplot, it doesn't need to be closed.
+    """
+
+    key = (name, rows, cols)
+    fig = FIGURES.get(key)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FIGURES[key] = fig
+    else:
+        fig.clear()
+
+    return fig, fig.subplots(rows, cols, squeeze=False)
 
 
-def aligned_colorbar(*args, **kwargs):
+def aligned_colorbar(fig: Figure, ax: Axes, mappable: ScalarMappable, **kwargs):
     """
-    Adds a colorbar to the right of a figure.
+    Adds a colorbar for the `mappable` to the right of the `ax` of a figure.
     """
 
-    cax = make_axes_locatable(plt.gca()).append_axes("right", size=0.3, pad=0.05)
-    plt.colorbar(*args, cax=cax, **kwargs)
+    cax = make_axes_locatable(ax).append_axes("right", size=0.3, pad=0.05)
+    fig.colorbar(mappable, cax=cax, **kwargs)
 
 
 def plot_vary_field(state: State, datapoint_dir: Path, parameter: Data):
     """
     Plots the perlin field from three view angles.
+    The `parameter` is not modified, so plotting it in a worker process of `visualization_stage()`, which only gets a
+    copy, has the same result as plotting it in the main process.
     """
 
     fig, axes = plt.subplots(2, 2, figsize=(10, 6))
@@ -184,13 +327,14 @@ def plot_vary_field(state: State, datapoint_dir: Path, parameter: Data):
     if not isinstance(parameter.value, np.ndarray):
         raise ValueError("Cannot visualize something that is not an np.ndarray")
 
-    if parameter.value.ndim != 3:
+    field: np.ndarray = parameter.value
+    if field.ndim != 3:
         # Reshape the data to match the 3D space of the domain
-        parameter.value = parameter.value.reshape(cast(np.ndarray, state.general.number_cells), order="F")
+        field = field.reshape(cast(np.ndarray, state.general.number_cells), order="F")
 
-    axes[0].imshow(parameter.value[:, :, int((parameter.value.shape[2] - 1) / 2)])
-    axes[2].imshow(parameter.value[:, int((parameter.value.shape[1] - 1) / 2), :])
-    axes[3].imshow(parameter.value[int((parameter.value.shape[0] - 1) / 2), :, :])
+    axes[0].imshow(field[:, :, int((field.shape[2] - 1) / 2)])
+    axes[2].imshow(field[:, int((field.shape[1] - 1) / 2), :])
+    axes[3].imshow(field[int((field.shape[0] - 1) / 2), :, :])
     axes[0].set_title("yz")
     axes[2].set_title("xz")
     axes[3].set_title("xy")
@@ -27,7 +27,7 @@ from h5py import File
 from ..data_structures import HeatPump, HeatPumps, Parameter, State, ValueTimeSeries
 from ..utils import create_dataset_and_datapoint_dirs, profile_function
 from ..validation_stage.validation_stage import are_duplicate_locations_in_heatpumps
-from ..variation_stage.vary import generate_heatpump_location
+from ..variation_stage.vary import cells_to_coordinates, generate_heatpump_location, generate_heatpump_locations
 
 
 @profile_function
@@ -59,21 +59,17 @@ def calculate_hp_coordinates(state: State) -> State:
     """Calculate the coordinates of each `vampireman.data_structures.HeatPump` by multiplying with the
     cell_resolution"""
 
-    for _, hp_data in state.heatpump_parameters.items():
-        assert isinstance(hp_data.value, HeatPump)
-        if hp_data.value.location is None:
-            # This means the heatpump is assigned a random location during vary stage anyway
-            continue
-
-        resolution = state.general.cell_resolution
+    resolution = state.general.cell_resolution
 
+    for _, hp_data in state.heatpump_parameters.items():
         hp = hp_data.value
         assert isinstance(hp, HeatPump)
+        if hp.location is None:
+            # This means the heatpump is assigned a random location during vary stage anyway
+            continue
 
         # This is needed as we need to calculate the heatpump coordinates for pflotran.in
-        result_location = (np.array(hp.location) - 1) * resolution + (resolution * 0.5)
-
-        hp.location = cast(list[float], result_location.tolist())
+        hp.location = cells_to_coordinates(hp.location, resolution)
 
     return state
 
@@ -101,6 +97,9 @@ def generate_heatpumps(state: State) -> State:
         if not isinstance(hps.value, HeatPumps):
             raise ValueError("There was a non HeatPumps item in heatpump_parameters")
 
+        # Draw the locations of all heatpumps at once, only clashing ones are drawn again one by one
+        locations = generate_heatpump_locations(state, state.get_rng(), hps.value.number)
+
         for index in range(hps.value.number):  # type:ignore
             name = f"{hps.name}_{index}"
             if (state.heatpump_parameters.get(name) is not None) and (new_heatpumps.get(name) is not None):
@@ -111,7 +110,7 @@ def generate_heatpumps(state: State) -> State:
             injection_temp = hps.value.injection_temp
             injection_rate = hps.value.injection_rate
 
-            location = generate_heatpump_location(state)
+            location = locations[index]
 
             heatpump = HeatPump(
                 location=cast(list[float], location),
@@ -125,7 +124,7 @@ def generate_heatpumps(state: State) -> State:
             while are_duplicate_locations_in_heatpumps(heatpumps):
                 # Generate new heatpump location if the one we had is already taken
                 # TODO write test for this
-                heatpump.location = generate_heatpump_location(state)
+                heatpump.location = generate_heatpump_location(state, state.get_rng())
 
             new_heatpumps[name] = Parameter(
                 name=name,
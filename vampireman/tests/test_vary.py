@@ -1,9 +1,12 @@
 import numpy as np
+import pytest
 
 from vampireman import preparation_stage, variation_stage
 from vampireman.data_structures import (
     Distribution,
     HeatPump,
+    HeatPumps,
+    NoiseMethod,
     Parameter,
     State,
     ValueMinMax,
@@ -12,6 +15,16 @@ from vampireman.data_structures import (
     Vary,
 )
 from vampireman.utils import create_dataset_and_datapoint_dirs
+from vampireman.variation_stage.vary import (
+    VARY_HANDLERS,
+    cells_to_coordinates,
+    check_parameters,
+    generate_heatpump_location,
+    get_const_values,
+    handle_heatpump_values,
+    vary_parameter,
+)
+from vampireman.variation_stage.vary_perlin import create_const_field
 
 
 def test_vary_copy():
@@ -275,3 +288,125 @@ def test_time_based_state():
 
     state = preparation_stage(state)
     assert state.heatpump_parameters.get("hp1").value.injection_temp.values.get(1) == 1
+
+
+def test_vary_handlers_cover_all_modes():
+    assert set(VARY_HANDLERS) == set(Vary)
+
+
+def test_cells_to_coordinates():
+    assert cells_to_coordinates([1, 1, 1], 5.0) == [2.5, 2.5, 2.5]
+    assert cells_to_coordinates([16, 32, 1], 5.0) == [77.5, 157.5, 2.5]
+
+
+def test_vary_parallel(tmp_path):
+    datapoints = []
+    for workers in [1, 2]:
+        state = State()
+        state.general.interactive = False
+        state.general.number_datapoints = 3
+        state.general.variation_workers = workers
+        state.general.output_directory = tmp_path / f"workers-{workers}"
+
+        create_dataset_and_datapoint_dirs(state)
+
+        state.hydrogeological_parameters["param_perlin"] = Parameter(
+            name="param_perlin",
+            vary=Vary.SPACE,
+            value=ValuePerlin(frequency=[18, 18, 18], max=2, min=1),
+        )
+
+        state = preparation_stage(state)
+        state = variation_stage(state)
+        assert len(state.datapoints) == 3
+        datapoints.append(state.datapoints)
+
+    # Every datapoint has its own RNG, so the results must not depend on the number of workers
+    for sequential, parallel in zip(*datapoints, strict=True):
+        assert np.array_equal(sequential.data["param_perlin"].value, parallel.data["param_perlin"].value)
+    assert not np.array_equal(datapoints[0][0].data["param_perlin"].value, datapoints[0][1].data["param_perlin"].value)
+
+
+def test_create_const_field():
+    state = State()
+    state.general.number_cells = np.array([4, 8, 2])
+
+    field = create_const_field(state, 1.5)
+    assert field.shape == (4, 8, 2)
+    assert np.all(field == 1.5)
+
+    values = np.arange(4 * 8 * 2, dtype=float)
+    field = create_const_field(state, values)
+    assert field.shape == (4, 8, 2)
+    assert np.array_equal(field.flatten(), values)
+
+
+def test_check_parameters():
+    state = State()
+    state.general.interactive = False
+
+    state.heatpump_parameters["hps"] = Parameter(
+        name="hps",
+        vary=Vary.SPACE,
+        value=HeatPumps(number=2, injection_temp=13.6, injection_rate=0.00024),
+    )
+    with pytest.raises(ValueError):
+        check_parameters(state)
+
+    state = preparation_stage(state)
+    check_parameters(state)
+
+
+def test_generate_heatpump_location():
+    state = State()
+    state.general.number_cells = np.array([4, 8, 2])
+    rand = np.random.default_rng(0)
+
+    for _ in range(100):
+        location = generate_heatpump_location(state, rand)
+        assert len(location) == 3
+        for cell, number_cells in zip(location, [4, 8, 2], strict=True):
+            assert 1 <= cell <= number_cells
+
+
+def test_vary_space_noise_methods():
+    for method in NoiseMethod:
+        state = State()
+        state.general.interactive = False
+        state.general.number_cells = np.array([16, 32, 2])
+
+        parameter = Parameter(
+            name="param_noise",
+            vary=Vary.SPACE,
+            value=ValuePerlin(frequency=[4, 4, 4], max=2, min=1, method=method),
+        )
+
+        data_0 = vary_parameter(state, parameter, 0, np.random.default_rng(0))
+        data_1 = vary_parameter(state, parameter, 1, np.random.default_rng(1))
+
+        assert data_0.value.shape == (16, 32, 2)
+        assert np.isclose(data_0.value.min(), 1)
+        assert np.isclose(data_0.value.max(), 2)
+        assert not np.array_equal(data_0.value, data_1.value)
+
+
+def test_get_const_values():
+    assert get_const_values(1, 5, Distribution.UNIFORM, 3).tolist() == [1, 3, 5]
+    assert np.allclose(get_const_values(1, 100, Distribution.LOG, 3), [1, 10, 100])
+    # A single datapoint gets the min value instead of dividing by zero
+    assert get_const_values(1, 5, Distribution.UNIFORM, 1).tolist() == [1]
+
+
+def test_handle_heatpump_values_keeps_parameter():
+    hp = HeatPump(
+        location=[1, 1, 1],
+        injection_temp=ValueTimeSeries(values={0: ValueMinMax(min=10, max=15)}),
+        injection_rate=ValueTimeSeries(values={0: 0.0002}),
+    )
+
+    result = handle_heatpump_values(np.random.default_rng(0), hp)
+
+    assert 10 <= result.injection_temp.values[0] <= 15
+    assert result.injection_rate.values[0] == 0.0002
+    # The min/max values are needed again for the next datapoint
+    assert hp.injection_temp.values[0] == ValueMinMax(min=10, max=15)
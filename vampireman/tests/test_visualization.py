@@ -1,4 +1,12 @@
 import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+import h5py
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
 
 from vampireman import (
     preparation_stage,
@@ -8,15 +16,24 @@ from vampireman import (
     visualization_stage,
 )
 from vampireman.data_structures import State
+from vampireman.pflotran.visualization_stage import (
+    TimeData,
+    make_plottable,
+    pflotran_time_to_year,
+    plot_y,
+    release_figures,
+)
 from vampireman.utils import create_dataset_and_datapoint_dirs
 
+REFERENCE_FILES = Path(__file__).parents[2] / "reference_files"
+
 
 def test_vis_files_not_empty(tmp_path):
     state = State()
     state.general.interactive = False
     state.general.mpirun = False
     state.general.output_directory = tmp_path / "render_test"
-    state.general.number_cells = [32, 64, 2]
+    state.general.number_cells = [32, 64, 4]
 
     create_dataset_and_datapoint_dirs(state)
     state = preparation_stage(state)
@@ -36,3 +53,99 @@ def test_vis_files_not_empty(tmp_path):
         # Check if files are not empty
         # TODO: Better test
         assert os.path.getsize(datapoint_path / file) > 0
+
+
+def test_vis_parallel(tmp_path):
+    state = State()
+    state.general.interactive = False
+    state.general.output_directory = tmp_path / "vis_test"
+    state.general.number_cells = [32, 64, 4]
+    state.general.number_datapoints = 3
+    state.general.visualization_workers = 2
+
+    create_dataset_and_datapoint_dirs(state)
+    state = preparation_stage(state)
+    state = variation_stage(state)
+    render_stage(state)
+
+    # The reference simulation results have the same domain, so no simulation is needed
+    for index in range(state.general.number_datapoints):
+        shutil.copy(REFERENCE_FILES / "pflotran.h5", state.general.output_directory / f"datapoint-{index}")
+
+    visualization_stage(state)
+
+    for index in range(state.general.number_datapoints):
+        datapoint_path = state.general.output_directory / f"datapoint-{index}"
+        for file in ["permeability_field.png", "Pflotran_isolines.jpg", "Pflotran_properties_2d.jpg"]:
+            assert os.path.getsize(datapoint_path / file) > 0
+
+
+def test_pflotran_time_to_year():
+    assert pflotran_time_to_year("   3 Time  5.00000E+00 y") == 5.0
+    assert pflotran_time_to_year("   0 Time  0.00000E+00 y") == 0.0
+    assert pflotran_time_to_year("  12 Time  2.75000E+01 y") == 27.5
+
+    with pytest.raises(ValueError):
+        pflotran_time_to_year("Coordinates")
+
+
+def test_make_plottable(tmp_path):
+    state = State()
+    state.general.number_cells = [2, 3, 4]
+
+    values = np.arange(2 * 3 * 4, dtype=np.float64)
+    with h5py.File(tmp_path / "pflotran.h5", "w") as file:
+        # Named such that sorting by name doesn't give the temporal order
+        for time_step in ["   1 Time  1.00000E+01 y", "   2 Time  5.00000E+00 y"]:
+            file.create_dataset(f"{time_step}/Temperature [C]", data=values)
+
+    with h5py.File(tmp_path / "pflotran.h5") as file:
+        full = make_plottable(state, file)
+        sliced = make_plottable(state, file, 1)
+
+    assert list(full.keys()) == ["   2 Time  5.00000E+00 y", "   1 Time  1.00000E+01 y"]
+    assert full["   2 Time  5.00000E+00 y"]["Temperature [C]"].shape == (2, 3, 4)
+    assert np.array_equal(
+        sliced["   2 Time  5.00000E+00 y"]["Temperature [C]"],
+        full["   2 Time  5.00000E+00 y"]["Temperature [C]"][:, :, 1],
+    )
+
+
+def test_make_plottable_wrong_number_cells(tmp_path):
+    state = State()
+    state.general.number_cells = [2, 3, 2]
+
+    with h5py.File(tmp_path / "pflotran.h5", "w") as file:
+        file.create_dataset("   1 Time  1.00000E+01 y/Temperature [C]", data=np.arange(2 * 3 * 4, dtype=np.float64))
+
+    with h5py.File(tmp_path / "pflotran.h5") as file:
+        with pytest.raises(ValueError):
+            make_plottable(state, file)
+        with pytest.raises(ValueError):
+            make_plottable(state, file, 1)
+
+
+def test_plot_y_reused_figure(tmp_path):
+    def time_data(scale: float) -> TimeData:
+        data: TimeData = OrderedDict()
+        for time_step in ["   1 Time  5.00000E+00 y", "   2 Time  1.00000E+01 y"]:
+            data[time_step] = OrderedDict(
+                (name, np.arange(8 * 16, dtype=np.float64).reshape(8, 16) * scale * factor)
+                for name, factor in [("Temperature [C]", 1), ("Liquid Pressure [Pa]", 3)]
+            )
+        return data
+
+    for name in ["first", "reused", "fresh"]:
+        (tmp_path / name).mkdir()
+
+    # The tick labels of the second datapoint are much wider, so a stale layout would show
+    plot_y(time_data(1), tmp_path / "first")
+    plot_y(time_data(1e6), tmp_path / "reused")
+    release_figures()
+    plot_y(time_data(1e6), tmp_path / "fresh")
+    release_figures()
+
+    assert np.array_equal(
+        plt.imread(tmp_path / "reused" / "Pflotran_properties_2d.jpg"),
+        plt.imread(tmp_path / "fresh" / "Pflotran_properties_2d.jpg"),
+    )
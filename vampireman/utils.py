@@ -110,6 +110,25 @@ def profile_function(function):
     return wrapper
 
 
+def prepare_worker_pool(state: "State", workers: int | None, number_tasks: int) -> tuple[int, int, "State"]:
+    """
+    Returns what is needed to hand `number_tasks` tasks to a `concurrent.futures.ProcessPoolExecutor`:
+    the number of worker processes for a `workers` setting, where `None` means one per core, the chunksize for
+    `concurrent.futures.Executor.map` and a copy of the `state` without `DataPoint`s to send to the workers.
+    """
+
+    number_workers = workers or os.cpu_count() or 1
+    # Sending the tasks in chunks means the arguments are pickled once per chunk instead of once per task; the same
+    # heuristic as `multiprocessing.Pool.map` leaves enough chunks to balance the workers
+    chunksize = max(1, number_tasks // (4 * number_workers))
+
+    # The workers don't need any datapoints. Sending a copy without them keeps the pickled state from growing with the
+    # number of datapoints, even while the results are collected.
+    worker_state = state.model_copy(update={"datapoints": []})
+
+    return number_workers, chunksize, worker_state
+
+
 def create_dataset_and_datapoint_dirs(state: "State"):
     """
     For each of the `DataPoint`s create a directory.
@@ -1,9 +1,12 @@
+import functools
 import logging
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
+from itertools import repeat
 from typing import cast
 
 import numpy as np
-from numpy.typing import ArrayLike
 
 from ..data_structures import (
     Data,
@@ -18,117 +21,201 @@ from ..data_structures import (
     ValueTimeSeries,
     Vary,
 )
+from ..utils import prepare_worker_pool
 from .vary_perlin import create_perlin_field
 
+VaryHandler = Callable[[State, Parameter, int, np.random.Generator], Data]
+"""
+Signature of the functions that vary a `vampireman.data_structures.Parameter` for the `DataPoint` with the given index.
+"""
 
-def copy_parameter(state: State, parameter: Parameter) -> Data:
+
+def copy_parameter(state: State, parameter: Parameter, rand: np.random.Generator) -> Data:
     """
     This function simply copies all values from a `Parameter` to a `Data` object without any transformation.
     """
 
     if isinstance(parameter.value, HeatPump):
-        return vary_heatpump(state, parameter)
+        return vary_heatpump(state, parameter, rand)
+    if isinstance(parameter.value, int | float | str):
+        # Immutable values can be shared across the datapoints without copying them
+        return Data(name=parameter.name, value=parameter.value)
     return Data(name=parameter.name, value=deepcopy(parameter.value))
 
 
-def vary_heatpump(state: State, parameter: Parameter) -> Data:
+def vary_heatpump(state: State, parameter: Parameter, rand: np.random.Generator) -> Data:
     """
     This function calculates operational parameters for `vampireman.data_structures.HeatPump`s.
     If the `vampireman.data_structures.Vary` mode is SPACE, the location will be drawn randomly.
     """
 
-    hp = deepcopy(parameter.value)
-    assert isinstance(hp, HeatPump)
-
-    hp = handle_heatpump_values(state.get_rng(), hp)
+    # No copy of the parameter value needed, `handle_heatpump_values()` returns new injection values
+    hp = handle_heatpump_values(rand, cast(HeatPump, parameter.value))
 
-    result_location = np.array(hp.location)
     if parameter.vary == Vary.SPACE:
-        result_location = generate_heatpump_location(state)  # XXX: Is this handling location clashes correctly?
-        resolution = state.general.cell_resolution
+        location = generate_heatpump_location(state, rand)  # XXX: Is this handling location clashes correctly?
         # This is needed as we need to calculate the heatpump coordinates for pflotran.in
-        result_location = (np.array(result_location) - 1) * resolution + (resolution * 0.5)
+        hp.location = cells_to_coordinates(location, state.general.cell_resolution)
+
+    return Data(name=parameter.name, value=hp)
+
+
+def vary_fixed(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Don't vary the `vampireman.data_structures.Parameter`, see `copy_parameter()`.
+    """
+
+    return copy_parameter(state, parameter, rand)
+
+
+def vary_const(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Vary a `vampireman.data_structures.ValueMinMax` linearly (or logarithmically, depending on
+    `vampireman.data_structures.Parameter.distribution`) across the `vampireman.data_structures.DataPoint`s.
+    """
+
+    if not isinstance(parameter.value, ValueMinMax):
+        logging.error(
+            "No implementation for %s and %s in parameter %s",
+            type(parameter.value),
+            parameter.vary,
+            parameter.name,
+        )
+        raise NotImplementedError()
+
+    values = get_const_values(
+        parameter.value.min, parameter.value.max, parameter.distribution, state.general.number_datapoints
+    )
 
     return Data(
         name=parameter.name,
-        value=HeatPump(
-            location=cast(list[float], result_location),
-            injection_temp=hp.injection_temp,
-            injection_rate=hp.injection_rate,
-        ),
+        value=float(values[index]),
     )
 
 
-def vary_parameter(state: State, parameter: Parameter, index: int) -> Data:
+@functools.cache
+def get_const_values(min: float, max: float, distribution: Distribution, number_datapoints: int) -> np.ndarray:
     """
-    This function does the variation of `vampireman.data_structures.Parameter`s.
-    It does so by implementing a large match-case that in turn invokes other functions that then work on the
-    `vampireman.data_structures.Parameter.value` based on the `vampireman.data_structures.Parameter.vary` type.
+    Returns the values of a `vampireman.data_structures.Vary.CONST` parameter for all
+    `vampireman.data_structures.DataPoint`s, evenly spaced from `min` to `max`.
+    The values are only calculated once per parameter and then looked up for each
+    `vampireman.data_structures.DataPoint`.
     """
 
-    assert not isinstance(parameter.value, HeatPumps)
-    match parameter.vary:
-        case Vary.FIXED:
-            data = copy_parameter(state, parameter)
+    if distribution == Distribution.LOG:
+        max = np.log10(max)
+        min = np.log10(min)
 
-        case Vary.CONST:
-            if isinstance(parameter.value, ValueMinMax):
-                max = deepcopy(parameter.value.max)
-                min = deepcopy(parameter.value.min)
+    values = np.linspace(min, max, number_datapoints)
 
-                if parameter.distribution == Distribution.LOG:
-                    max = np.log10(max)
-                    min = np.log10(min)
+    if distribution == Distribution.LOG:
+        values = 10**values
 
-                distance = max - min
-                step_width = distance / (state.general.number_datapoints - 1)
-                value = min + step_width * index
+    # The array is shared between all callers
+    values.setflags(write=False)
+    return values
 
-                if parameter.distribution == Distribution.LOG:
-                    value = 10**value
 
-                data = Data(
-                    name=parameter.name,
-                    value=value,
-                )
-            else:
-                logging.error(
-                    "No implementation for %s and %s in parameter %s",
-                    type(parameter.value),
-                    parameter.vary,
-                    parameter.name,
-                )
-                raise NotImplementedError()
+def vary_space_field(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Generate a spatially varying field from a `vampireman.data_structures.ValuePerlin`.
+    """
 
-        case Vary.SPACE:
-            if isinstance(parameter.value, ValuePerlin):
-                data = Data(
-                    name=parameter.name,
-                    value=create_perlin_field(state, parameter),
-                )
-            elif isinstance(parameter.value, float):
-                raise ValueError(
-                    f"Parameter {parameter.name} is vary.space and has a float value, "
-                    f"it should be set to vary.fixed with a min/max value instead; {parameter}"
-                )
-            # This should be inside the CONST block, yet it seems to make more sense to users to find it here
-            elif isinstance(parameter.value, HeatPump):
-                data = vary_heatpump(state, parameter)
-            elif isinstance(parameter.value, ValueMinMax):
-                raise ValueError(
-                    f"Parameter {parameter.name} is vary.space and has min/max values, "
-                    f"it should be set to vary.perlin instead; {parameter}"
-                )
-            else:
-                raise NotImplementedError(f"Dont know how to vary {parameter}")
-                
-        case Vary.LIST:
-            data = data = Data(
-                    name=parameter.name,
-                    value=deepcopy(parameter.value[index]),
-                )
+    return Data(
+        name=parameter.name,
+        value=create_perlin_field(state, parameter, rand),
+    )
+
+
+def vary_space_heatpump(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Draw a random location for a `vampireman.data_structures.HeatPump`, see `vary_heatpump()`.
+    """
+
+    return vary_heatpump(state, parameter, rand)
+
+
+def get_space_handler(parameter: Parameter) -> VaryHandler:
+    """
+    Look up the function that varies a `vampireman.data_structures.Parameter` spatially, based on the type of the
+    `vampireman.data_structures.Parameter.value`.
+    """
+
+    if isinstance(parameter.value, ValuePerlin):
+        return vary_space_field
+    if isinstance(parameter.value, float):
+        raise ValueError(
+            f"Parameter {parameter.name} is vary.space and has a float value, "
+            f"it should be set to vary.fixed with a min/max value instead; {parameter}"
+        )
+    # This should be inside the CONST block, yet it seems to make more sense to users to find it here
+    if isinstance(parameter.value, HeatPump):
+        return vary_space_heatpump
+    if isinstance(parameter.value, ValueMinMax):
+        raise ValueError(
+            f"Parameter {parameter.name} is vary.space and has min/max values, "
+            f"it should be set to vary.perlin instead; {parameter}"
+        )
+    raise NotImplementedError(f"Dont know how to vary {parameter}")
+
+
+def vary_space(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Vary a `vampireman.data_structures.Parameter` spatially, i.e., generate a perlin field or draw a random
+    `vampireman.data_structures.HeatPump` location.
+    """
+
+    return get_space_handler(parameter)(state, parameter, index, rand)
+
+
+def vary_list(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    Take the `index`th item of the `vampireman.data_structures.Parameter.value`.
+    """
+
+    return Data(
+        name=parameter.name,
+        value=deepcopy(parameter.value[index]),  # pyright: ignore
+    )
+
+
+VARY_HANDLERS: dict[Vary, VaryHandler] = {
+    Vary.FIXED: vary_fixed,
+    Vary.CONST: vary_const,
+    Vary.SPACE: vary_space,
+    Vary.LIST: vary_list,
+}
+"""
+Maps each `vampireman.data_structures.Vary` mode to the function that varies a
+`vampireman.data_structures.Parameter` in that mode.
+"""
+
+
+def get_vary_handler(parameter: Parameter) -> VaryHandler:
+    """
+    Look up the function for the `vampireman.data_structures.Parameter.vary` mode in `VARY_HANDLERS`.
+    For `vampireman.data_structures.Vary.SPACE`, the function is also chosen by the type of the value, so this doesn't
+    need to be checked again for each `vampireman.data_structures.DataPoint`.
+    """
+
+    if parameter.vary == Vary.SPACE:
+        return get_space_handler(parameter)
 
-    return data
+    handler = VARY_HANDLERS.get(parameter.vary)
+    if handler is None:
+        raise NotImplementedError(f"Dont know how to vary {parameter}")
+    return handler
+
+
+def vary_parameter(state: State, parameter: Parameter, index: int, rand: np.random.Generator) -> Data:
+    """
+    This function does the variation of `vampireman.data_structures.Parameter`s.
+    It looks up the function for the `vampireman.data_structures.Parameter.vary` mode in `VARY_HANDLERS` that then
+    works on the `vampireman.data_structures.Parameter.value`.
+    All randomness is drawn from `rand`, the random number generator of the current `DataPoint`.
+    """
+
+    return get_vary_handler(parameter)(state, parameter, index, rand)
 
 
 def handle_heatpump_values(rand: np.random.Generator, hp_data: HeatPump) -> HeatPump:
@@ -137,52 +224,148 @@ def handle_heatpump_values(rand: np.random.Generator, hp_data: HeatPump) -> Heat
     sequence.
     If the value is a scalar, it is left as-is, if it is a `vampireman.data_structures.ValueMinMax`, a random value is
     calculated.
+    The `hp_data` is not modified, a new `vampireman.data_structures.HeatPump` with its own location and new
+    `vampireman.data_structures.ValueTimeSeries` is returned.
+    """
+
+    # Both are converted to ValueTimeSeries by the preparation stage, which is checked by `check_parameters()`
+    injection_temp = cast(ValueTimeSeries, hp_data.injection_temp)
+    injection_rate = cast(ValueTimeSeries, hp_data.injection_rate)
+
+    def draw_values(time_series: ValueTimeSeries) -> ValueTimeSeries:
+        values: dict[float, ValueMinMax | float] = {}
+        for timestep, value in time_series.values.items():
+            # Iterate over each of the heat pumps time value
+            if isinstance(value, ValueMinMax):
+                # Value is given as min/max
+                value = value.max - (rand.random() * (value.max - value.min))
+            values[timestep] = value
+        # Shallow copy, only the values dict differs
+        return time_series.model_copy(update={"values": values})
+
+    return hp_data.model_copy(
+        update={
+            # The location list would otherwise be shared with the parameter and all other datapoints
+            "location": None if hp_data.location is None else list(hp_data.location),
+            "injection_temp": draw_values(injection_temp),
+            "injection_rate": draw_values(injection_rate),
+        }
+    )
+
+
+def cells_to_coordinates(location: list[float], resolution: float) -> list[float]:
+    """
+    Translate a cell based location into the coordinates of the cell center.
+    """
+
+    # For three values, plain python arithmetic is faster than allocating several intermediate numpy arrays
+    half_resolution = resolution * 0.5
+    return [(float(cell) - 1) * resolution + half_resolution for cell in location]
+
+
+def generate_heatpump_location(state: State, rand: np.random.Generator) -> list[float]:
+    """
+    Return a list of three random cell indices, cell based, i.e., starting at 1.
+    """
+
+    number_cells = cast(np.ndarray, state.general.number_cells)
+    return cast(list[float], rand.integers(1, number_cells, size=3, endpoint=True).tolist())
+
+
+def generate_heatpump_locations(state: State, rand: np.random.Generator, number: int) -> list[list[float]]:
+    """
+    Return `number` lists of three random float values, cell based, like `generate_heatpump_location()` does.
+    All locations are drawn from the RNG at once.
     """
 
-    assert isinstance(hp_data.injection_temp, ValueTimeSeries)
-    assert isinstance(hp_data.injection_rate, ValueTimeSeries)
+    number_cells = cast(np.ndarray, state.general.number_cells)
+    return cast(list[list[float]], rand.integers(1, number_cells, size=(number, 3), endpoint=True).tolist())
 
-    for timestep, value in hp_data.injection_temp.values.items():
-        # Iterate over each of the heat pumps time value
-        if isinstance(value, ValueMinMax):
-            # Value is given as min/max
-            hp_data.injection_temp.values[timestep] = value.max - (rand.random() * (value.max - value.min))
 
-    for timestep, value in hp_data.injection_rate.values.items():
-        # Iterate over each of the heat pumps time value
-        if isinstance(value, ValueMinMax):
-            # Value is given as min/max
-            hp_data.injection_rate.values[timestep] = value.max - (rand.random() * (value.max - value.min))
+def generate_datapoint(
+    state: State,
+    parameters: tuple[tuple[Parameter, VaryHandler], ...],
+    datapoint_index: int,
+    seed: np.random.SeedSequence,
+) -> DataPoint:
+    """
+    Calls the vary function for each of the `parameters` for a single `vampireman.data_structures.DataPoint`.
+    The `parameters` hold each `vampireman.data_structures.Parameter` together with its function from
+    `VARY_HANDLERS`, so the lookup doesn't need to be repeated for each `vampireman.data_structures.DataPoint`.
+    `vampireman.data_structures.DataPoint`s don't depend on each other, as each of them draws its random numbers from
+    its own generator seeded by `seed`. So this can be called for each index independently and in any order.
+    """
+
+    rand = np.random.default_rng(seed)
+    data = {}
 
-    return hp_data
+    for parameter, handler in parameters:
+        data[parameter.name] = handler(state, parameter, datapoint_index, rand)
 
+    return DataPoint(index=datapoint_index, data=data)
 
-def generate_heatpump_location(state: State) -> list[float]:
+
+def check_parameters(state: State):
     """
-    Return a list of three random float values, cell based.
+    Check that all `vampireman.data_structures.Parameter`s are in the form the variation functions expect.
+    Parameters don't change across `vampireman.data_structures.DataPoint`s, so this is done once before generating
+    them instead of in each call of `vary_parameter()`.
     """
 
-    random_vector = state.get_rng().random(3)
-    random_location = random_vector * cast(np.ndarray, state.general.number_cells)
-    return cast(list[float], np.ceil(random_location).tolist())
+    for name, parameter in (state.hydrogeological_parameters | state.heatpump_parameters).items():
+        if isinstance(parameter.value, HeatPumps):
+            raise ValueError(f"HeatPumps {name} should have been turned into HeatPump parameters during preparation")
+        if isinstance(parameter.value, HeatPump) and not (
+            isinstance(parameter.value.injection_temp, ValueTimeSeries)
+            and isinstance(parameter.value.injection_rate, ValueTimeSeries)
+        ):
+            raise ValueError(f"HeatPump {name} should have time based injection values after preparation")
 
 
 def vary_params(state: State) -> State:
     """
-    Calls the `vary_parameter()` function for each `vampireman.data_structures.Parameter` in each
-    `vampireman.data_structures.Datapoint` sequentially.
+    Calls the `generate_datapoint()` function for each `vampireman.data_structures.Datapoint`.
+    Depending on `vampireman.data_structures.GeneralConfig.variation_workers`, this is done sequentially or in parallel
+    worker processes.
     """
 
-    for datapoint_index in range(state.general.number_datapoints):
-        data = {}
+    check_parameters(state)
 
-        # This syntax merges the hydrogeological_parameters and the heatpump_parameters dicts so we don't have to write
-        # two separate for loops
-        for _, parameter in (state.hydrogeological_parameters | state.heatpump_parameters).items():
-            parameter_data = vary_parameter(state, parameter, datapoint_index)
-            data[parameter.name] = parameter_data
+    number_datapoints = state.general.number_datapoints
+    workers = state.general.variation_workers
 
-        state.datapoints.append(DataPoint(index=datapoint_index, data=data))
+    # This syntax merges the hydrogeological_parameters and the heatpump_parameters dicts so we don't have to write
+    # two separate for loops. It is done once here instead of for each datapoint.
+    parameters = tuple(
+        (parameter, get_vary_handler(parameter))
+        for parameter in (state.hydrogeological_parameters | state.heatpump_parameters).values()
+    )
+
+    # Each datapoint gets its own seed derived from the random_seed, so the results don't depend on the order in which
+    # the datapoints are generated
+    seeds = np.random.SeedSequence(state.general.random_seed).spawn(number_datapoints)
+
+    if workers == 1 or number_datapoints == 1:
+        state.datapoints.extend(
+            generate_datapoint(state, parameters, datapoint_index, seed) for datapoint_index, seed in enumerate(seeds)
+        )
+    else:
+        number_workers, chunksize, worker_state = prepare_worker_pool(state, workers, number_datapoints)
+
+        with ProcessPoolExecutor(max_workers=number_workers) as executor:
+            # `map` yields the results in the order of the datapoint indices
+            datapoints = list(
+                executor.map(
+                    generate_datapoint,
+                    repeat(worker_state),
+                    repeat(parameters),
+                    range(number_datapoints),
+                    seeds,
+                    chunksize=chunksize,
+                )
+            )
+        state.datapoints.extend(datapoints)
+        logging.debug("Generated %s datapoints with %s worker processes", number_datapoints, number_workers)
 
     if state.general.shuffle_datapoints:
         state = shuffle_datapoints(state)
@@ -200,19 +383,14 @@ def shuffle_datapoints(state: State) -> State:
     `vampireman.data_structures.DataPoint` and max values in the last one.
     """
 
-    parameters: dict[str, list[Data]] = {}
-
-    parameter_names = list(state.datapoints[0].data)
-    for parameter in parameter_names:
-        for datapoint in state.datapoints:
-            param_list = parameters.get(parameter, [])
-            param_list.append(datapoint.data[parameter])
-            parameters[parameter] = param_list
+    rand = state.get_rng()
 
-        state.get_rng().shuffle(cast(ArrayLike, parameters[parameter]))
+    for parameter_name in state.datapoints[0].data:
+        # Collect the data of this parameter from all datapoints, shuffle it and distribute it again
+        parameter_data = [datapoint.data[parameter_name] for datapoint in state.datapoints]
+        rand.shuffle(parameter_data)
 
-    for parameter in parameter_names:
-        for index in range(state.general.number_datapoints):
-            state.datapoints[index].data[parameter] = parameters[parameter][index]
+        for datapoint, data in zip(state.datapoints, parameter_data, strict=True):
+            datapoint.data[parameter_name] = data
 
     return state
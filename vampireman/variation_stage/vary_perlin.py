@@ -3,8 +3,28 @@ from typing import Any, cast
 import noise
 import numpy as np
 from numpy.typing import NDArray
+from scipy.ndimage import gaussian_filter1d, zoom
 
-from ..data_structures import Distribution, Parameter, State, ValueMinMax, ValuePerlin
+from ..data_structures import Distribution, NoiseMethod, Parameter, State, ValueMinMax, ValuePerlin
+
+
+def rescale_to_range(
+    values: NDArray[np.floating[Any]], aimed_min: float, aimed_max: float
+) -> NDArray[np.floating[Any]]:
+    """
+    Scale the `values` in place, so they range from `aimed_min` to `aimed_max`.
+    Doing this in place means no temporary arrays of the grid size are allocated.
+    """
+
+    current_min = np.min(values)
+    current_max = np.max(values)
+
+    values -= current_min
+    values /= current_max - current_min
+    values *= aimed_max - aimed_min
+    values += aimed_min
+
+    return values
 
 
 def make_perlin_grid(
@@ -34,36 +54,82 @@ def make_perlin_grid(
     simulation_area_max = max(grid_dimensions)
     scale = np.array(grid_dimensions) / simulation_area_max
 
-    # Create the grid indices
-    i, j, k = np.meshgrid(
-        np.arange(grid_dimensions[0]), np.arange(grid_dimensions[1]), np.arange(grid_dimensions[2]), indexing="ij"
+    # Normalize the cell indices once per axis instead of for each cell of the grid
+    x_axis, y_axis, z_axis = (
+        (np.arange(cells) / cells * scale[axis] + offset[axis]) * freq[axis]
+        for axis, cells in enumerate(grid_dimensions)
     )
 
-    # Normalize
-    x = (i / grid_dimensions[0] * scale[0] + offset[0]) * freq[0]
-    y = (j / grid_dimensions[1] * scale[1] + offset[1]) * freq[1]
-    z = (k / grid_dimensions[2] * scale[2] + offset[2]) * freq[2]
+    # Shapes are (x, 1, 1), (1, y, 1) and (1, 1, z), numpy broadcasts them to the whole grid
+    x, y, z = np.meshgrid(x_axis, y_axis, z_axis, indexing="ij", sparse=True)
 
-    values = np.vectorize(noise.pnoise3)(x, y, z)
+    # Giving otypes avoids an extra call to determine the output type
+    values = np.vectorize(noise.pnoise3, otypes=[np.float64])(x, y, z)
 
-    # scale to intended range
-    current_min = np.min(values)
-    current_max = np.max(values)
+    return rescale_to_range(values, aimed_min, aimed_max)
 
-    values = (values - current_min) / (current_max - current_min)
-    values = values * (aimed_max - aimed_min) + aimed_min
 
-    return values
+def make_value_noise_grid(
+    aimed_min: float,
+    aimed_max: float,
+    state: State,
+    rand: np.random.Generator,
+    freq: list[float],
+) -> NDArray[np.floating[Any]]:
+    """
+    Generate a value noise grid in the size of the domain as a numpy array.
+    Random values are drawn on a coarse lattice with a point for each period of the perlin noise with the same `freq`
+    (see `make_perlin_grid()`) and linearly interpolated to the cells of the domain.
+    Values are calculated between the `aimed_min` and `aimed_max`.
+    """
 
+    grid_dimensions: list[int] = state.general.number_cells.tolist()  # pyright: ignore
+    scale = np.array(grid_dimensions) / max(grid_dimensions)
+
+    # At least two lattice points per axis, so there is something to interpolate in between
+    lattice = [max(2, int(np.ceil(scale[axis] * freq[axis])) + 1) for axis in range(3)]
+    coarse_values = rand.standard_normal(lattice)
+
+    values = cast(NDArray[np.float64], zoom(coarse_values, np.array(grid_dimensions) / lattice, order=1))
+
+    return rescale_to_range(values, aimed_min, aimed_max)
+
+
+def make_smoothed_noise_grid(
+    aimed_min: float,
+    aimed_max: float,
+    state: State,
+    rand: np.random.Generator,
+    freq: list[float],
+) -> NDArray[np.floating[Any]]:
+    """
+    Generate a gaussian smoothed noise grid in the size of the domain as a numpy array.
+    Random values are drawn for each cell and smoothed along each axis with a one dimensional gaussian filter, whose
+    width matches the size of the features of the perlin noise with the same `freq` (see `make_perlin_grid()`).
+    Values are calculated between the `aimed_min` and `aimed_max`.
+    """
+
+    grid_dimensions: list[int] = state.general.number_cells.tolist()  # pyright: ignore
+
+    values = rand.standard_normal(grid_dimensions)
 
-def create_perlin_field(state: State, parameter: Parameter):
+    for axis in range(3):
+        # One period of the perlin noise spans max(grid_dimensions) / freq cells, a quarter of it is a feature
+        sigma = max(grid_dimensions) / freq[axis] / 4
+        values = gaussian_filter1d(values, sigma, axis=axis)
+
+    return rescale_to_range(values, aimed_min, aimed_max)
+
+
+def create_perlin_field(state: State, parameter: Parameter, rand: np.random.Generator):
     """
     Creates a perlin field for a data point from a `vampireman.data_structures.Parameter`.
+    The field is generated with the `vampireman.data_structures.ValuePerlin.method`.
     If the `vampireman.data_structures.ValuePerlin.frequency` is a `vampireman.data_structures.ValueMinMax`, random
     values will be calculated.
     """
 
-    base_offset = state.get_rng().random(3) * 4242
+    base_offset = rand.random(3) * 4242
 
     if not isinstance(parameter.value, ValuePerlin):
         raise ValueError()
@@ -72,8 +138,6 @@ def create_perlin_field(state: State, parameter: Parameter):
 
     if isinstance(freq_factor, ValueMinMax):
         # If the frequency is `ValueMinMax`, get random values for x,y,z
-        rand = state.get_rng()
-
         min = freq_factor.min
         max = freq_factor.max
 
@@ -93,13 +157,19 @@ def create_perlin_field(state: State, parameter: Parameter):
         vary_min = np.log10(vary_min)
         vary_max = np.log10(vary_max)
 
-    cells = make_perlin_grid(
-        vary_min,
-        vary_max,
-        state,
-        base_offset,
-        freq_factor,
-    )
+    match parameter.value.method:
+        case NoiseMethod.PERLIN:
+            cells = make_perlin_grid(
+                vary_min,
+                vary_max,
+                state,
+                base_offset,
+                freq_factor,
+            )
+        case NoiseMethod.VALUE:
+            cells = make_value_noise_grid(vary_min, vary_max, state, rand, freq_factor)
+        case NoiseMethod.SMOOTHED:
+            cells = make_smoothed_noise_grid(vary_min, vary_max, state, rand, freq_factor)
 
     if parameter.distribution == Distribution.LOG:
         cells = 10**cells
@@ -113,11 +183,13 @@ def create_perlin_field(state: State, parameter: Parameter):
 def create_const_field(state: State, value: float | NDArray):
     """
     Create a constant field, as large as the domain, with the same `value` for each cell.
+    For a scalar `value`, the field is a read-only view that doesn't allocate memory for each of the cells.
     """
 
+    shape = tuple(int(cells) for cells in state.general.number_cells)
     if np.size(value) > 1:
-        value = value.reshape(state.general.number_cells)  # pyright: ignore
-    return np.full(cast(np.ndarray, state.general.number_cells), value)
+        return np.reshape(value, shape)
+    return np.broadcast_to(value, shape)
 
 
 def calc_pressure_from_gradient_field(
@@ -144,10 +216,11 @@ def calc_pressure_from_gradient_field(
     reference = 101325  # Standard atmosphere pressure in Pa
     resolution = state.general.cell_resolution
 
-    pressure_field = np.zeros_like(gradient_field)
+    # The pressure starts at the reference in the first column and each further column adds its gradient, which is a
+    # cumulative sum along the second axis
+    pressure_field = gradient_field * resolution * 1000
     pressure_field[:, 0] = reference
-    for i in range(1, pressure_field.shape[1]):
-        pressure_field[:, i] = pressure_field[:, i - 1] + gradient_field[:, i] * resolution * 1000
+    pressure_field = np.cumsum(pressure_field, axis=1)
     pressure_field = pressure_field[::-1]
 
     return pressure_field